@@ -1,7 +1,9 @@
 import sys
 import os
+import functools
 import json
-import time
+import sqlite3
+import subprocess
 from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -14,193 +16,277 @@ from PyQt6.QtWidgets import (
     QListWidget,
     QFileDialog,
     QMessageBox,
-    QInputDialog,
     QCheckBox,
     QProgressDialog,
 )
-from PyQt6.QtCore import Qt
-from pathlib import Path
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
 import threading
-import queue
-from contextlib import contextmanager
-import tempfile
 
 
-class FileTagManager:
-    def __init__(self):
-        self.db_file = "file_tags.json"
-        self.tags_db = self._load_db()
-        self._save_queue = queue.Queue()
-        self._last_save = 0
-        self._save_lock = threading.Lock()
-        self._pending_changes = False
-        self._start_save_thread()
-
-    def _start_save_thread(self):
-        """Start background thread for saving changes"""
-        self._save_thread = threading.Thread(target=self._save_worker, daemon=True)
-        self._save_thread.start()
-
-    def _save_worker(self):
-        """Background worker that handles saving the database"""
-        while True:
+def _iter_files(root):
+    """Yield paths of all files under root, using scandir so each entry's
+    type comes back from the directory read instead of an extra stat"""
+    try:
+        entries = os.scandir(root)
+    except OSError:
+        # Unreadable directory; skip it like os.walk did
+        return
+    with entries:
+        for entry in entries:
             try:
-                # Wait for changes to save
-                self._save_queue.get(timeout=1)
-
-                # Rate limit saves to once per second
-                time_since_last_save = time.time() - self._last_save
-                if time_since_last_save < 1:
-                    time.sleep(1 - time_since_last_save)
-
-                with self._save_lock:
-                    if self._pending_changes:
-                        self._save_db_with_retry()
-                        self._pending_changes = False
-                        self._last_save = time.time()
-
-                self._save_queue.task_done()
-            except queue.Empty:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _iter_files(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path
+            except OSError:
                 continue
-            except Exception as e:
-                print(f"Error in save worker: {e}")
 
-    def _save_db_with_retry(self, max_retries=3, delay=1):
-        """Save database with retry mechanism"""
-        for attempt in range(max_retries):
-            try:
-                # Create temporary file in the same directory
-                temp_dir = os.path.dirname(os.path.abspath(self.db_file))
-                with tempfile.NamedTemporaryFile(
-                    mode="w", dir=temp_dir, delete=False, suffix=".tmp"
-                ) as temp_file:
-                    json.dump(self.tags_db, temp_file, indent=4)
-                    temp_file.flush()
-                    os.fsync(temp_file.fileno())  # Ensure all data is written
-
-                # Attempt to rename the temporary file
-                if os.path.exists(self.db_file):
-                    if sys.platform == "win32":
+
+class FileTagManager:
+    def __init__(self):
+        self.db_file = "file_tags.db"
+        # The GUI thread and the tagging worker share this connection;
+        # sqlite3 objects aren't thread-safe, so every access goes
+        # through _db_lock
+        self._db_lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        # WAL keeps writes durable without an fsync per statement
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tags ("
+            "    filepath TEXT NOT NULL,"
+            "    tag TEXT NOT NULL,"
+            "    PRIMARY KEY (filepath, tag)"
+            ")"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tag ON tags(tag)")
+        self.conn.commit()
+        self._migrate_legacy_json()
+        self._basename_cache = {}
+        # Bound per-instance memo of recent searches; any mutation clears it
+        self._search_impl = functools.lru_cache(maxsize=128)(self._search_uncached)
+
+    def _migrate_legacy_json(self):
+        """One-time import of the old JSON snapshot and journal, if present"""
+        snapshot_path = "file_tags.json"
+        journal_path = snapshot_path + ".log"
+        if not os.path.exists(snapshot_path) and not os.path.exists(journal_path):
+            return
+        db = {}
+        try:
+            if os.path.exists(snapshot_path):
+                with open(snapshot_path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                    if content.strip():
+                        db = {k: set(v) for k, v in json.loads(content).items()}
+            if os.path.exists(journal_path):
+                with open(journal_path, "r", encoding="utf-8") as f:
+                    for line in f:
                         try:
-                            os.remove(self.db_file)
-                        except PermissionError:
-                            time.sleep(delay)
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
                             continue
-
-                os.rename(temp_file.name, self.db_file)
-                return
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    raise
-                time.sleep(delay)
-                delay *= 2  # Exponential backoff
-
-    def queue_save(self):
-        """Queue a save operation"""
-        with self._save_lock:
-            self._pending_changes = True
-        self._save_queue.put(True)
-
-    def _load_db(self):
-        """Load the tags database with proper error handling"""
-        if os.path.exists(self.db_file):
+                        filepath, tag = record["f"], record["t"]
+                        if record["op"] == "add":
+                            db.setdefault(filepath, set()).add(tag)
+                        elif record["op"] == "remove" and filepath in db:
+                            db[filepath].discard(tag)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error migrating legacy database: {e}")
+            return
+        if db:
+            with self._db_lock, self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO tags VALUES (?, ?)",
+                    [(f, t) for f, tags in db.items() for t in tags],
+                )
+        # Rename rather than delete so the originals survive as a backup
+        for path in (snapshot_path, journal_path):
             try:
-                with open(self.db_file, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    if not content.strip():
-                        return {}
-                    return json.loads(content)
-            except (json.JSONDecodeError, FileNotFoundError, PermissionError) as e:
-                backup_file = f"{self.db_file}.backup"
-                try:
-                    if (
-                        os.path.exists(self.db_file)
-                        and os.path.getsize(self.db_file) > 0
-                    ):
-                        os.rename(self.db_file, backup_file)
-                except OSError:
-                    pass
-                return {}
-        return {}
+                if os.path.exists(path):
+                    os.rename(path, path + ".imported")
+            except OSError:
+                pass
+
+    def close(self):
+        """Close the database connection, flushing any WAL state"""
+        with self._db_lock:
+            self.conn.commit()
+            self.conn.close()
 
     def add_tags(self, filepath, tags):
         """Add tags with error handling"""
         try:
-            filepath = str(Path(filepath))
-            if filepath not in self.tags_db:
-                self.tags_db[filepath] = []
-            for tag in tags:
-                tag = tag.strip().lower()
-                if tag and tag not in self.tags_db[filepath]:
-                    self.tags_db[filepath].append(tag)
-            self.queue_save()
+            filepath = os.path.normpath(filepath)
+            clean_tags = {t.strip().lower() for t in tags if t.strip()}
+            if not clean_tags:
+                return
+            self._basename_cache[filepath] = os.path.basename(filepath)
+            with self._db_lock, self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO tags VALUES (?, ?)",
+                    [(filepath, tag) for tag in clean_tags],
+                )
+            self._search_impl.cache_clear()
         except Exception as e:
             raise RuntimeError(f"Failed to add tags: {e}")
 
     def add_tags_to_directory(self, directory, tags, progress_callback=None):
-        """Add tags to all files in a directory with batched saves"""
+        """Add tags to all files in a directory, streaming the walk so
+        tagging starts immediately and memory stays bounded.
+
+        The callback receives (files_processed, 0) - the total is unknown
+        until the walk finishes."""
         try:
-            files = []
-            for root, _, filenames in os.walk(directory):
-                for filename in filenames:
-                    files.append(os.path.join(root, filename))
-
-            total_files = len(files)
-            batch_size = 100  # Process files in batches
-
-            for i in range(0, total_files, batch_size):
-                batch = files[i : i + batch_size]
-                for filepath in batch:
-                    if filepath not in self.tags_db:
-                        self.tags_db[filepath] = []
-                    for tag in tags:
-                        tag = tag.strip().lower()
-                        if tag and tag not in self.tags_db[filepath]:
-                            self.tags_db[filepath].append(tag)
-
-                self.queue_save()  # Save after each batch
-
-                if progress_callback:
-                    progress_callback(min(i + batch_size, total_files), total_files)
-
-            return total_files
+            batch_size = 100  # Insert/report once per this many files
+            processed = 0
+            rows = []
+
+            # Normalize once; the tag list is fixed for the whole walk
+            clean_tags = {t.strip().lower() for t in tags if t.strip()}
+            insert = "INSERT OR IGNORE INTO tags VALUES (?, ?)"
+
+            for filepath in _iter_files(directory):
+                self._basename_cache[filepath] = os.path.basename(filepath)
+                for tag in clean_tags:
+                    rows.append((filepath, tag))
+
+                processed += 1
+                if processed % batch_size == 0:
+                    # One transaction per batch; holding the lock for the
+                    # whole walk would stall searches on the GUI thread
+                    with self._db_lock, self.conn:
+                        self.conn.executemany(insert, rows)
+                    rows = []
+                    if progress_callback:
+                        progress_callback(processed, 0)
+
+            if rows:
+                with self._db_lock, self.conn:
+                    self.conn.executemany(insert, rows)
+            if progress_callback:
+                progress_callback(processed, 0)
+
+            self._search_impl.cache_clear()
+
+            return processed
         except Exception as e:
             raise RuntimeError(f"Failed to add tags to directory: {e}")
 
     def remove_tag(self, filepath, tag):
         """Remove tag with error handling"""
         try:
-            filepath = str(Path(filepath))
-            if filepath in self.tags_db and tag in self.tags_db[filepath]:
-                self.tags_db[filepath].remove(tag)
-                if not self.tags_db[filepath]:
-                    del self.tags_db[filepath]
-                self.queue_save()
+            filepath = os.path.normpath(filepath)
+            with self._db_lock:
+                with self.conn:
+                    self.conn.execute(
+                        "DELETE FROM tags WHERE filepath = ? AND tag = ?",
+                        (filepath, tag),
+                    )
+                remaining = self.conn.execute(
+                    "SELECT 1 FROM tags WHERE filepath = ? LIMIT 1", (filepath,)
+                ).fetchone()
+            if remaining is None:
+                self._basename_cache.pop(filepath, None)
+            self._search_impl.cache_clear()
         except Exception as e:
             raise RuntimeError(f"Failed to remove tag: {e}")
 
     def get_tags(self, filepath):
         """Get tags with error handling"""
         try:
-            filepath = str(Path(filepath))
-            return self.tags_db.get(filepath, [])
+            filepath = os.path.normpath(filepath)
+            with self._db_lock:
+                rows = self.conn.execute(
+                    "SELECT tag FROM tags WHERE filepath = ? ORDER BY tag",
+                    (filepath,),
+                ).fetchall()
+            return [tag for (tag,) in rows]
         except Exception as e:
             print(f"Error getting tags: {e}")
             return []
 
+    def export_json(self, path):
+        """Write the database out as readable JSON, for inspection/backup"""
+        with self._db_lock:
+            rows = self.conn.execute(
+                "SELECT filepath, tag FROM tags ORDER BY filepath, tag"
+            ).fetchall()
+        db = {}
+        for filepath, tag in rows:
+            db.setdefault(filepath, []).append(tag)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(db, f, indent=4)
+
+    def get_basename(self, filepath):
+        """Cached os.path.basename for paths already in the database"""
+        name = self._basename_cache.get(filepath)
+        if name is None:
+            name = os.path.basename(filepath)
+            self._basename_cache[filepath] = name
+        return name
+
     def search_by_tags(self, search_tags):
         """Search tags with error handling"""
         try:
-            search_tags = [tag.strip().lower() for tag in search_tags]
-            results = []
-            for filepath, tags in self.tags_db.items():
-                if all(tag in tags for tag in search_tags):
-                    results.append(filepath)
-            return results
+            # Dedup via set, then sorted tuple so equivalent queries share
+            # a cache entry and repeated terms don't add INTERSECT legs
+            search_tags = tuple(sorted({tag.strip().lower() for tag in search_tags}))
+            return self._search_impl(search_tags)
         except Exception as e:
             print(f"Error searching tags: {e}")
             return []
 
+    def _search_uncached(self, search_tags):
+        if not search_tags:
+            query = "SELECT DISTINCT filepath FROM tags"
+        else:
+            # Each term probes idx_tag; INTERSECT does the set merge in C
+            query = " INTERSECT ".join(
+                ["SELECT filepath FROM tags WHERE tag = ?"] * len(search_tags)
+            )
+        with self._db_lock:
+            rows = self.conn.execute(query, search_tags).fetchall()
+        return [filepath for (filepath,) in rows]
+
+
+class TagWorkerSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(int)
+    error = pyqtSignal(str)
+
+
+class TagWorker(QRunnable):
+    """Runs a directory tagging walk off the GUI thread"""
+
+    def __init__(self, tag_manager, directory, tags):
+        super().__init__()
+        self.tag_manager = tag_manager
+        self.directory = directory
+        self.tags = tags
+        self.signals = TagWorkerSignals()
+
+    def run(self):
+        last_step = [-1]
+
+        def report(current, total):
+            # The callback fires every 100 files; forwarding each one
+            # queues an event (and a repaint) on the GUI thread, so only
+            # emit when the count crosses a 1000-file step
+            step = current // 1000
+            if step != last_step[0]:
+                last_step[0] = step
+                self.signals.progress.emit(current, total)
+
+        try:
+            total = self.tag_manager.add_tags_to_directory(
+                self.directory, self.tags, report
+            )
+            self.signals.finished.emit(total)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -239,10 +325,10 @@ class MainWindow(QMainWindow):
         tag_layout = QHBoxLayout()
         self.tag_input = QLineEdit()
         self.tag_input.setPlaceholderText("Enter tags (comma-separated)")
-        add_tag_btn = QPushButton("Add Tags")
-        add_tag_btn.clicked.connect(self.add_tags)
+        self.add_tag_btn = QPushButton("Add Tags")
+        self.add_tag_btn.clicked.connect(self.add_tags)
         tag_layout.addWidget(self.tag_input)
-        tag_layout.addWidget(add_tag_btn)
+        tag_layout.addWidget(self.add_tag_btn)
         layout.addLayout(tag_layout)
 
         # Directory options
@@ -313,40 +399,69 @@ class MainWindow(QMainWindow):
                 self.tag_input.clear()
                 self.update_tags_list()
             else:  # Directory
-                progress = QProgressDialog(
-                    "Adding tags to files...", "Cancel", 0, 100, self
-                )
-                progress.setWindowModality(Qt.WindowModality.WindowModal)
-
-                def update_progress(current, total):
-                    progress.setValue(int(current / total * 100))
-
                 directory = self.current_file
                 if self.include_subdirs.isChecked():
-                    total_files = self.tag_manager.add_tags_to_directory(
-                        directory, tags, update_progress
+                    # Run the walk on a worker thread so the event loop
+                    # keeps painting; progress arrives via queued signals.
+                    # Indeterminate dialog: the walk streams, so the total
+                    # file count is unknown until it finishes
+                    progress = QProgressDialog(
+                        "Adding tags to files...", "Cancel", 0, 0, self
+                    )
+                    progress.setWindowModality(Qt.WindowModality.WindowModal)
+
+                    def update_progress(current, total):
+                        progress.setLabelText(
+                            f"Adding tags to files... ({current} files)"
+                        )
+
+                    worker = TagWorker(self.tag_manager, directory, tags)
+                    worker.signals.progress.connect(update_progress)
+                    worker.signals.finished.connect(
+                        lambda total: self._directory_tagging_done(progress)
+                    )
+                    worker.signals.error.connect(
+                        lambda message: self._directory_tagging_failed(
+                            progress, message
+                        )
                     )
+                    self.add_tag_btn.setEnabled(False)
+                    self._tag_worker = worker
+                    QThreadPool.globalInstance().start(worker)
                 else:
                     # Only process files in the current directory
                     for filename in os.listdir(directory):
                         filepath = os.path.join(directory, filename)
                         if os.path.isfile(filepath):
                             self.tag_manager.add_tags(filepath, tags)
-
-                progress.setValue(100)
-                self.tag_input.clear()
-                QMessageBox.information(
-                    self, "Success", f"Added tags to files in directory"
-                )
+                    self.tag_input.clear()
+                    QMessageBox.information(
+                        self, "Success", f"Added tags to files in directory"
+                    )
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Failed to add tags: {e}")
 
+    def _directory_tagging_done(self, progress):
+        progress.close()
+        self.add_tag_btn.setEnabled(True)
+        self.tag_input.clear()
+        QMessageBox.information(self, "Success", f"Added tags to files in directory")
+
+    def _directory_tagging_failed(self, progress, message):
+        progress.close()
+        self.add_tag_btn.setEnabled(True)
+        QMessageBox.warning(self, "Error", f"Failed to add tags: {message}")
+
     def update_tags_list(self):
         try:
-            self.tags_list.clear()
-            if self.current_file and os.path.isfile(self.current_file):
-                tags = self.tag_manager.get_tags(self.current_file)
-                self.tags_list.addItems(tags)
+            self.tags_list.setUpdatesEnabled(False)
+            try:
+                self.tags_list.clear()
+                if self.current_file and os.path.isfile(self.current_file):
+                    tags = self.tag_manager.get_tags(self.current_file)
+                    self.tags_list.addItems(tags)
+            finally:
+                self.tags_list.setUpdatesEnabled(True)
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Failed to update tags list: {e}")
 
@@ -375,8 +490,17 @@ class MainWindow(QMainWindow):
                 return
 
             results = self.tag_manager.search_by_tags(search_terms)
-            self.results_list.clear()
-            self.results_list.addItems([os.path.basename(path) for path in results])
+            # One repaint for the whole refill instead of one per item;
+            # sorting stays off so Qt doesn't re-sort on every insert
+            self.results_list.setUpdatesEnabled(False)
+            self.results_list.setSortingEnabled(False)
+            try:
+                self.results_list.clear()
+                self.results_list.addItems(
+                    [self.tag_manager.get_basename(path) for path in results]
+                )
+            finally:
+                self.results_list.setUpdatesEnabled(True)
             self.results_list.setToolTip("Double-click to open file location")
 
             # Store full paths for opening files
@@ -384,19 +508,42 @@ class MainWindow(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Failed to search files: {e}")
 
+    def closeEvent(self, event):
+        try:
+            self.tag_manager.close()
+        except Exception as e:
+            print(f"Error closing database: {e}")
+        event.accept()
+
     def open_file_location(self, item):
         try:
             index = self.results_list.row(item)
             filepath = self._search_results[index]
 
-            # Open the file's directory and select the file
-            directory = os.path.dirname(filepath)
-            os.system(f'explorer /select,"{filepath}"')
+            # Open the file's directory and select the file; fire-and-forget
+            # so the GUI thread isn't blocked waiting on the file manager
+            if sys.platform == "win32":
+                subprocess.Popen(["explorer", f"/select,{filepath}"], close_fds=True)
+            elif sys.platform == "darwin":
+                subprocess.Popen(["open", "-R", filepath], close_fds=True)
+            else:
+                subprocess.Popen(
+                    ["xdg-open", os.path.dirname(filepath)], close_fds=True
+                )
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Failed to open file location: {e}")
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--export-json":
+        # Debug aid: the tag store is a binary SQLite file, so offer a
+        # readable dump without opening the GUI
+        manager = FileTagManager()
+        out_path = sys.argv[2] if len(sys.argv) > 2 else "file_tags_export.json"
+        manager.export_json(out_path)
+        manager.close()
+        print(f"Exported tags to {out_path}")
+        sys.exit(0)
     try:
         app = QApplication(sys.argv)
         window = MainWindow()